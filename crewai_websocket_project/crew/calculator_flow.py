@@ -2,9 +2,15 @@ import random
 from crewai.flow.flow import Flow, listen, router, start
 from pydantic import BaseModel
 import os
+import sys
+from pathlib import Path
 
 os.environ['CREWAI_DISABLE_TELEMETRY'] = 'true'
 
+# reuse the server's plot cache: the plot is only re-rendered when the flow graph changes
+sys.path.insert(0, str(Path(__file__).resolve().parent / "calculator_flow_ws"))
+from plot_cache import plot_once
+
 class CalculatorState(BaseModel):
     num_1: int = 0
     num_2: int = 0
@@ -63,5 +69,5 @@ class CalculatorFlow(Flow[CalculatorState]):
 
 
 flow = CalculatorFlow()
-flow.plot("my_calculator_plot")
+plot_once(flow, "my_calculator_plot")
 flow.kickoff()
\ No newline at end of file
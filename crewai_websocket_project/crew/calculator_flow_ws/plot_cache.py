@@ -0,0 +1,165 @@
+# plot_cache.py
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+from static_assets import StaticAsset
+
+try:
+    from crewai.flow.visualization import build_flow_structure
+except ImportError:  # crewai releases that predate the visualization package
+    build_flow_structure = None
+
+PLOT_CACHE_DIR = Path(os.environ.get("FLOW_PLOT_CACHE_DIR", ".plot_cache"))
+
+# first line of every plot we write, so a rerun can tell whether it is stale
+HASH_MARKER = "<!-- flow-graph-hash: {} -->\n"
+
+LEGACY_GRAPH_ATTRS = ("_start_methods", "_listeners", "_routers", "_router_paths")
+
+
+def _flow_structure(flow_cls):
+    if build_flow_structure is not None:
+        return build_flow_structure(flow_cls)
+    legacy = {attr: getattr(flow_cls, attr, None) for attr in LEGACY_GRAPH_ATTRS}
+    if all(value is None for value in legacy.values()):
+        raise TypeError(f"can't read the flow graph of {flow_cls.__qualname__} with this crewai version")
+    return legacy
+
+
+def _json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(map(str, value))
+    return repr(value)
+
+
+def flow_graph_hash(flow_cls) -> str:
+    """
+    Hash of the structure flow.plot() draws. The crewai version is included
+    because the plot template changes between releases.
+    """
+    try:
+        from crewai import __version__ as crewai_version
+    except ImportError:
+        crewai_version = "unknown"
+
+    structure = json.dumps(_flow_structure(flow_cls), sort_keys=True, default=_json_default)
+    parts = [flow_cls.__module__, flow_cls.__qualname__, crewai_version, structure]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def _inline_assets(html: str, asset_dir: Path) -> str:
+    """Inline the stylesheet and script plot() writes next to its HTML."""
+
+    def stylesheet(match):
+        path = asset_dir / match.group(1)
+        if not path.is_file():
+            return match.group(0)
+        return "<style>\n" + path.read_text(encoding="utf-8") + "\n</style>"
+
+    def script(match):
+        path = asset_dir / match.group(1)
+        if not path.is_file():
+            return match.group(0)
+        code = path.read_text(encoding="utf-8").replace("</script", "<\\/script")
+        return "<script>\n" + code + "\n</script>"
+
+    html = re.sub(r'<link rel="stylesheet" href="([^":/]+)"\s*/?>', stylesheet, html)
+    return re.sub(r'<script src="([^":/]+)"></script>', script, html)
+
+
+def render_plot(flow, name: str) -> str:
+    """
+    Run flow.plot() without opening a browser and return one self-contained
+    HTML document.
+    """
+    try:
+        # crewai 1.x: writes HTML, CSS and JS into a fresh temp dir and returns the HTML path
+        html_path = Path(flow.plot(f"{name}.html", show=False))
+    except TypeError:
+        # older crewai: plot(filename) writes "<filename>.html" relative to the cwd
+        legacy_dir = Path(tempfile.mkdtemp(prefix="flow_plot_"))
+        flow.plot(str(legacy_dir / name))
+        html_path = legacy_dir / f"{name}.html"
+    try:
+        return _inline_assets(html_path.read_text(encoding="utf-8"), html_path.parent)
+    finally:
+        # only ever remove the throwaway directory plot() (or we) just made
+        plot_dir = html_path.parent
+        if plot_dir.parent == Path(tempfile.gettempdir()) and plot_dir.name.startswith(("crewai_flow_", "flow_plot_")):
+            shutil.rmtree(plot_dir, ignore_errors=True)
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    # a crashed or concurrent run never leaves a half-written plot behind
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def plot_once(flow, filename: str) -> Path:
+    """
+    Write "<filename>.html" for flow, skipping the render when the file
+    already holds a plot of the same graph hash.
+    """
+    path = Path(f"{filename}.html")
+    marker = HASH_MARKER.format(flow_graph_hash(type(flow)))
+    if path.exists():
+        with path.open(encoding="utf-8") as f:
+            if f.readline() == marker:
+                return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _write_atomic(path, marker + render_plot(flow, path.stem))
+    return path
+
+
+class FlowPlotCache:
+    """
+    Generates each registered flow's plot once per graph hash and keeps it
+    on disk (so restarts don't re-plot) and in memory as a precompressed
+    StaticAsset (so requests don't touch the disk or the compressor).
+    """
+
+    def __init__(self, cache_dir: Path = PLOT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self._factories = {}
+        self._hashes = {}
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, flow_cls, flow_factory=None) -> None:
+        """flow_factory() builds the instance to plot; it defaults to flow_cls()."""
+        self._factories[name] = (flow_cls, flow_factory or flow_cls)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._factories
+
+    def _plot_to_disk(self, name: str, graph_hash: str) -> Path:
+        path = self.cache_dir / f"{name}-{graph_hash}.html"
+        if path.exists():
+            return path
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        logging.info("generating flow plot %s (%s)", name, graph_hash)
+        _, flow_factory = self._factories[name]
+        _write_atomic(path, HASH_MARKER.format(graph_hash) + render_plot(flow_factory(), name))
+        return path
+
+    def get(self, name: str) -> StaticAsset:
+        """Blocking (may run flow.plot()); call from a worker thread."""
+        with self._lock:
+            if name not in self._hashes:
+                # the graph of a loaded class can't change, so hash it once per process
+                flow_cls, _ = self._factories[name]
+                self._hashes[name] = flow_graph_hash(flow_cls)
+            key = (name, self._hashes[name])
+            if key not in self._assets:
+                path = self._plot_to_disk(*key)
+                self._assets[key] = StaticAsset(path.read_bytes(), "text/html; charset=utf-8")
+            return self._assets[key]
@@ -0,0 +1,206 @@
+# scheduler.py
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+
+DEFAULT_WEIGHTS = "interactive=8,batch=1"
+
+
+def _parse_weights(spec: str) -> dict:
+    """Parse "name=weight,..."; a malformed spec falls back to DEFAULT_WEIGHTS."""
+    weights = {}
+    try:
+        for part in spec.split(","):
+            name, _, weight = part.partition("=")
+            if name.strip():
+                weights[name.strip()] = max(1, int(weight or 1))
+    except ValueError:
+        weights = {}
+    if not weights:
+        logging.warning("invalid FLOW_PRIORITY_WEIGHTS %r; using %r", spec, DEFAULT_WEIGHTS)
+        return _parse_weights(DEFAULT_WEIGHTS)
+    return weights
+
+
+PRIORITY_WEIGHTS = _parse_weights(os.environ.get("FLOW_PRIORITY_WEIGHTS", DEFAULT_WEIGHTS))
+DEFAULT_PRIORITY = os.environ.get("FLOW_DEFAULT_PRIORITY", "interactive")
+STEP_SLOTS = int(os.environ.get("FLOW_STEP_SLOTS", os.cpu_count() or 4))
+DELIVERY_SLOTS = int(os.environ.get("FLOW_DELIVERY_SLOTS", "32"))
+
+# queueing delays kept per class for the percentile report
+DELAY_WINDOW = 2048
+
+
+class _Waiter:
+    __slots__ = ("session_id", "priority", "enqueued", "grant", "granted")
+
+    def __init__(self, session_id, priority, grant):
+        self.session_id = session_id
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.grant = grant
+        self.granted = False
+
+
+class FairScheduler:
+    """
+    Hands out a fixed number of slots to waiting sessions.
+
+    Between priority classes it uses smooth weighted round-robin, so a class
+    with weight 8 gets 8 of every 9 grants against a weight-1 class while
+    both have waiters, without ever starving the lighter one. Within a
+    class, sessions take turns, so one chatty session can't crowd out the
+    rest of its class.
+
+    Slots can be taken from threads (acquire/slot) or from the event loop
+    (acquire_async/slot_async); both share one lock-protected queue.
+    """
+
+    def __init__(self, slots: int, weights: dict = None, default_priority: str = DEFAULT_PRIORITY):
+        self.slots = max(1, slots)
+        self.weights = dict(weights or PRIORITY_WEIGHTS)
+        self.default_priority = default_priority if default_priority in self.weights else next(iter(self.weights))
+        self._lock = threading.Lock()
+        self._running = 0
+        self._current = {p: 0 for p in self.weights}
+        self._turns = {p: deque() for p in self.weights}  # sessions with waiters, in turn order
+        self._waiting = {}  # session_id -> deque of _Waiter
+        self._delays = {p: deque(maxlen=DELAY_WINDOW) for p in self.weights}
+        self._grants = {p: 0 for p in self.weights}
+
+    @property
+    def lowest_priority(self) -> str:
+        return min(self.weights, key=self.weights.__getitem__)
+
+    def classify(self, priority: str) -> str:
+        return priority if priority in self.weights else self.default_priority
+
+    def _pick_class(self):
+        ready = [p for p, turns in self._turns.items() if turns]
+        if not ready:
+            return None
+        total = 0
+        for p in ready:
+            self._current[p] += self.weights[p]
+            total += self.weights[p]
+        chosen = max(ready, key=self._current.__getitem__)
+        self._current[chosen] -= total
+        return chosen
+
+    def _dispatch_locked(self) -> list:
+        granted = []
+        now = time.monotonic()
+        while self._running < self.slots:
+            priority = self._pick_class()
+            if priority is None:
+                break
+            turns = self._turns[priority]
+            session_id = turns.popleft()
+            queue = self._waiting[session_id]
+            waiter = queue.popleft()
+            if queue:
+                turns.append(session_id)
+            else:
+                del self._waiting[session_id]
+            waiter.granted = True
+            self._running += 1
+            self._grants[priority] += 1
+            self._delays[priority].append(now - waiter.enqueued)
+            granted.append(waiter)
+        return granted
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        with self._lock:
+            queue = self._waiting.get(waiter.session_id)
+            if queue is None:
+                queue = self._waiting[waiter.session_id] = deque()
+                self._turns[waiter.priority].append(waiter.session_id)
+            queue.append(waiter)
+            granted = self._dispatch_locked()
+        for w in granted:
+            w.grant()
+
+    def _cancel(self, waiter: _Waiter) -> None:
+        with self._lock:
+            if not waiter.granted:
+                queue = self._waiting[waiter.session_id]
+                queue.remove(waiter)
+                if not queue:
+                    del self._waiting[waiter.session_id]
+                    self._turns[waiter.priority].remove(waiter.session_id)
+                return
+        self.release()
+
+    def acquire(self, session_id: str, priority: str) -> None:
+        """Block the calling thread until a slot is granted."""
+        event = threading.Event()
+        self._enqueue(_Waiter(session_id, self.classify(priority), event.set))
+        event.wait()
+
+    async def acquire_async(self, session_id: str, priority: str) -> None:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+
+        def wake():
+            if not fut.done():
+                fut.set_result(None)
+
+        waiter = _Waiter(session_id, self.classify(priority), lambda: loop.call_soon_threadsafe(wake))
+        self._enqueue(waiter)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            self._cancel(waiter)
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            self._running -= 1
+            granted = self._dispatch_locked()
+        for w in granted:
+            w.grant()
+
+    @contextmanager
+    def slot(self, session_id: str, priority: str):
+        self.acquire(session_id, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self, session_id: str, priority: str):
+        await self.acquire_async(session_id, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            waiting = {p: 0 for p in self.weights}
+            for queue in self._waiting.values():
+                waiting[queue[0].priority] += len(queue)
+            report = {"slots": self.slots, "running": self._running, "classes": {}}
+            for p in self.weights:
+                delays = sorted(self._delays[p])
+                report["classes"][p] = {
+                    "weight": self.weights[p],
+                    "waiting": waiting[p],
+                    "granted": self._grants[p],
+                    "delay_ms_p50": _percentile_ms(delays, 0.50),
+                    "delay_ms_p99": _percentile_ms(delays, 0.99),
+                }
+            return report
+
+
+def _percentile_ms(sorted_delays, q: float) -> float:
+    if not sorted_delays:
+        return 0.0
+    index = min(len(sorted_delays) - 1, int(q * len(sorted_delays)))
+    return round(sorted_delays[index] * 1000, 3)
@@ -1,69 +1,251 @@
 # server.py
 import asyncio
+import hmac
 import logging
+import os
 import threading
 import queue
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 
 from flow_logic import CalculatorFlow
 from client_page import CLIENT_HTML
+from plot_cache import FlowPlotCache
+from scheduler import DELIVERY_SLOTS, STEP_SLOTS, FairScheduler
+from state_stream import StateStream, Watcher
+from static_assets import StaticAsset
 
 logging.basicConfig(level=logging.INFO)
 app = FastAPI()
 
-@app.get("/")
-async def root():
-    return HTMLResponse(CLIENT_HTML)
+# compressed once at import; requests only pick an encoding and compare ETags
+CLIENT_PAGE = StaticAsset.from_text(CLIENT_HTML)
+
+FLOW_PLOTS = FlowPlotCache()
+FLOW_PLOTS.register(
+    "calculator",
+    CalculatorFlow,
+    lambda: CalculatorFlow(send_user=lambda msg: None, ask_user=lambda prompt: ""),
+)
+
+# live sessions by id, for read-only state observers
+SESSIONS: "dict[str, StateStream]" = {}
+SESSION_PRIORITIES: "dict[str, str]" = {}
+
+# session listing and state watching expose every user's inputs, so they are
+# off unless a token is configured and presented as X-Observer-Token
+OBSERVER_TOKEN = os.environ.get("FLOW_OBSERVER_TOKEN", "")
+
+def observer_authorized(headers) -> bool:
+    presented = headers.get("x-observer-token", "")
+    return bool(OBSERVER_TOKEN) and hmac.compare_digest(presented.encode(), OBSERVER_TOKEN.encode())
+
+# flow steps and outbound sends are shared fairly across sessions, weighted by priority class
+STEP_SCHEDULER = FairScheduler(STEP_SLOTS)
+DELIVERY_SCHEDULER = FairScheduler(DELIVERY_SLOTS)
+
+# X-Priority-Class is only trusted from an auth gateway that maps the caller's
+# claim to a class and proves itself with X-Gateway-Secret; without a
+# configured secret the header is ignored, since any client could send it
+GATEWAY_SECRET = os.environ.get("FLOW_GATEWAY_SECRET", "")
+
+def gateway_priority(ws: WebSocket) -> str:
+    presented = ws.headers.get("x-gateway-secret", "")
+    if GATEWAY_SECRET and hmac.compare_digest(presented.encode(), GATEWAY_SECRET.encode()):
+        return ws.headers.get("x-priority-class", "")
+    return ""
+
+def priority_for(ws: WebSocket) -> str:
+    requested = gateway_priority(ws) or ws.query_params.get("priority", "")
+    return STEP_SCHEDULER.classify(requested)
+
+def observer_priority_for(ws: WebSocket) -> str:
+    # observers only outrank the lowest class when the gateway vouches for them
+    requested = gateway_priority(ws)
+    return requested if requested in DELIVERY_SCHEDULER.weights else DELIVERY_SCHEDULER.lowest_priority
+
+class SessionClosed(Exception):
+    """Raised in a flow worker whose client has gone, so the flow stops at its next prompt."""
+
+@app.api_route("/", methods=["GET", "HEAD"])
+async def root(request: Request):
+    return CLIENT_PAGE.response(request)
+
+@app.get("/flows/{name}/plot")
+def flow_plot(name: str, request: Request):
+    # sync endpoint: FastAPI runs it in the threadpool, so a first-time
+    # flow.plot() never blocks the event loop
+    if name not in FLOW_PLOTS:
+        raise HTTPException(status_code=404, detail=f"unknown flow: {name}")
+    return FLOW_PLOTS.get(name).response(request)
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    return {"steps": STEP_SCHEDULER.stats(), "delivery": DELIVERY_SCHEDULER.stats()}
 
 @app.websocket("/calc")
 async def calc_socket(ws: WebSocket):
     await ws.accept()
 
-    prompts_q: "queue.Queue[tuple[str,bool]]" = queue.Queue()
+    prompts_q: "queue.Queue[tuple[str,bool] | None]" = queue.Queue()
     answers_q: "queue.Queue[str]" = queue.Queue()
+    states = StateStream()
+    SESSIONS[states.session_id] = states
+    session_id = states.session_id
+    priority = SESSION_PRIORITIES[session_id] = priority_for(ws)
+    closed = threading.Event()
+    slot_held = False   # whether the worker thread currently holds a step slot
+    logging.info("session %s started (%s)", session_id, priority)
 
+    # state is diffed on the worker thread, which owns it, at every step
+    # boundary; patches go ahead of the message that follows the change
     def send_user(msg: str) -> None:
+        states.publish(flow.state)
         prompts_q.put((msg, False))
 
+    def take_step_slot() -> None:
+        nonlocal slot_held
+        STEP_SCHEDULER.acquire(session_id, priority)
+        if closed.is_set():
+            # the client left while we queued: hand the grant straight back
+            STEP_SCHEDULER.release()
+            raise SessionClosed(session_id)
+        slot_held = True
+
     def ask_user(prompt: str) -> str:
+        nonlocal slot_held
+        states.publish(flow.state)
         prompts_q.put((prompt, True))
-        return answers_q.get()   # blocks in worker thread
+        # the step yields here: no slot is held while a human is typing, and
+        # the next step queues behind other sessions for a fresh one
+        STEP_SCHEDULER.release()
+        slot_held = False
+        answer = answers_q.get()   # blocks in worker thread
+        if closed.is_set():
+            raise SessionClosed(session_id)   # dead sessions never take another grant
+        take_step_slot()
+        return answer
 
     flow = CalculatorFlow(send_user=send_user, ask_user=ask_user)
 
+    # opt-in (/calc?state=1): JSON snapshot/patch frames interleaved with prompts
+    def send_state(patch_frame, snapshot_frame) -> None:
+        if patch_frame is not None:
+            prompts_q.put((patch_frame, False))
+
+    # publish before anyone subscribes so the first snapshot carries real fields
+    states.publish(flow.state)
+    if ws.query_params.get("state") in ("1", "true"):
+        prompts_q.put((states.subscribe(send_state), False))
+
     def run_flow():
         try:
+            take_step_slot()
             flow.kickoff()   # synchronous kickoff
+            states.publish(flow.state)
         except Exception as e:
-            logging.exception("Flow raised exception")
-            prompts_q.put((f"[flow error] {e}", False))
+            if closed.is_set():
+                logging.info("session %s closed; flow abandoned", session_id)
+            else:
+                logging.exception("Flow raised exception")
+                prompts_q.put((f"[flow error] {e}", False))
+        finally:
+            if slot_held:
+                STEP_SCHEDULER.release()
+            prompts_q.put(None)   # wakes the pump so the session is torn down
+
+    def abandon() -> None:
+        # set before unblocking ask_user so the worker sees the flag
+        closed.set()
+        answers_q.put("")
+
+    # read the socket continuously so a disconnect is noticed even while the
+    # pump is idle waiting for the worker (e.g. queued for a step slot)
+    answers_in: "asyncio.Queue[str | None]" = asyncio.Queue()
+
+    async def receive_answers():
+        try:
+            while True:
+                answers_in.put_nowait(await ws.receive_text())
+        except (WebSocketDisconnect, RuntimeError):
+            logging.info("session %s client disconnected", session_id)
+        abandon()
+        answers_in.put_nowait(None)
+        prompts_q.put(None)   # wake the pump if it is waiting for the worker
 
     worker = threading.Thread(target=run_flow, daemon=True)
     worker.start()
+    receiver = asyncio.create_task(receive_answers())
 
     loop = asyncio.get_event_loop()
     try:
         while True:
-            if not worker.is_alive() and prompts_q.empty():
+            item = await loop.run_in_executor(None, prompts_q.get)
+            if item is None:
                 break
-            msg, expects_reply = await loop.run_in_executor(None, prompts_q.get)
+            msg, expects_reply = item
             try:
-                await ws.send_text(msg)
+                async with DELIVERY_SCHEDULER.slot_async(session_id, priority):
+                    await ws.send_text(msg)
             except WebSocketDisconnect:
                 if expects_reply:
-                    answers_q.put("")
+                    abandon()
                 break
 
             if expects_reply:
-                try:
-                    answer = await ws.receive_text()
-                except WebSocketDisconnect:
-                    answers_q.put("")
-                    break
+                answer = await answers_in.get()
+                if answer is None:
+                    break   # receive_answers already abandoned the flow
                 answers_q.put(answer)
     finally:
+        # bookkeeping first: if the handler is cancelled, the awaits below
+        # may never complete
+        receiver.cancel()
         if worker.is_alive():
-            answers_q.put("")  # unblock if waiting
-            worker.join(timeout=1)
+            abandon()  # unblock if waiting
+        closed.set()
+        SESSIONS.pop(session_id, None)
+        SESSION_PRIORITIES.pop(session_id, None)
+        states.close()
+        # joined off the loop so a teardown never stalls other sessions
+        await loop.run_in_executor(None, worker.join, 1)
+        await ws.close()
+
+@app.get("/sessions")
+async def list_sessions(request: Request):
+    """Read-only listing so observers can find sessions to attach to."""
+    if not observer_authorized(request.headers):
+        raise HTTPException(status_code=403, detail="observer token required")
+    return [
+        {"session": sid, "v": states.version, "priority": SESSION_PRIORITIES.get(sid)}
+        for sid, states in list(SESSIONS.items())
+    ]
+
+@app.websocket("/sessions/{session_id}/state")
+async def watch_state(ws: WebSocket, session_id: str):
+    """Read-only: a snapshot on (re)subscribe, then patches until the session ends."""
+    if not observer_authorized(ws.headers):
+        await ws.close(code=4403)
+        return
+    states = SESSIONS.get(session_id)
+    if states is None:
+        await ws.close(code=4404)
+        return
+    await ws.accept()
+
+    watcher = Watcher(asyncio.get_running_loop())
+    snapshot = states.subscribe(watcher.deliver)
+    # observers share delivery slots under their own id, below human clients by default
+    watcher_id, priority = f"{session_id}/watch/{id(watcher)}", observer_priority_for(ws)
+    try:
+        await ws.send_text(snapshot)
+        while True:
+            frame = await watcher.queue.get()
+            if frame is None:
+                break
+            async with DELIVERY_SCHEDULER.slot_async(watcher_id, priority):
+                await ws.send_text(frame)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        states.unsubscribe(watcher.deliver)
         await ws.close()
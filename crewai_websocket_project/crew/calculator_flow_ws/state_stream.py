@@ -0,0 +1,103 @@
+# state_stream.py
+import asyncio
+import json
+import threading
+import uuid
+
+from pydantic import BaseModel
+
+# Bounded so one stalled observer cannot grow memory without limit; a
+# watcher that falls this far behind is resynced with a snapshot instead.
+WATCHER_QUEUE_SIZE = 64
+
+
+def _frame(**fields) -> str:
+    return json.dumps(fields, separators=(",", ":"))
+
+
+class StateStream:
+    """
+    Versioned view of one session's flow state.
+
+    publish() is called from the flow worker thread at step boundaries. It
+    diffs the pydantic state against the last published dump and, if any
+    field changed, bumps the version and hands every subscriber the same
+    pre-serialized patch frame -- nothing is copied per subscriber.
+
+    Subscribers are callables deliver(patch_frame, snapshot_frame); a
+    patch_frame of None means the session has ended. Subscribing to a
+    stream that has already closed gets that None straight away.
+    """
+
+    def __init__(self, session_id: str = None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.version = 0
+        self._fields = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def _snapshot_frame(self) -> str:
+        return _frame(type="snapshot", session=self.session_id, v=self.version, state=self._fields)
+
+    def subscribe(self, deliver) -> str:
+        """Register deliver and return the snapshot it should be sent first."""
+        with self._lock:
+            snapshot_frame = self._snapshot_frame()
+            if not self.closed:
+                self._subscribers.append(deliver)
+                return snapshot_frame
+        deliver(None, snapshot_frame)
+        return snapshot_frame
+
+    def unsubscribe(self, deliver) -> None:
+        with self._lock:
+            if deliver in self._subscribers:
+                self._subscribers.remove(deliver)
+
+    def publish(self, state: BaseModel) -> None:
+        current = state.model_dump(mode="json")
+        with self._lock:
+            patch = {k: v for k, v in current.items() if self._fields.get(k, object()) != v}
+            if not patch:
+                return
+            self._fields = current
+            self.version += 1
+            patch_frame = _frame(type="patch", v=self.version, patch=patch)
+            snapshot_frame = self._snapshot_frame()
+            subscribers = list(self._subscribers)
+        for deliver in subscribers:
+            deliver(patch_frame, snapshot_frame)
+
+    def close(self) -> None:
+        with self._lock:
+            self.closed = True
+            subscribers, self._subscribers = self._subscribers, []
+            snapshot_frame = self._snapshot_frame()
+        for deliver in subscribers:
+            deliver(None, snapshot_frame)
+
+
+class Watcher:
+    """
+    Read-only observer living on the event loop. deliver() may be called
+    from any thread; frames land on an asyncio.Queue consumed by the
+    observer's websocket handler.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: "asyncio.Queue[str | None]" = asyncio.Queue(maxsize=WATCHER_QUEUE_SIZE)
+
+    def deliver(self, patch_frame, snapshot_frame) -> None:
+        self.loop.call_soon_threadsafe(self._offer, patch_frame, snapshot_frame)
+
+    def _offer(self, patch_frame, snapshot_frame) -> None:
+        if self.queue.full():
+            # too far behind for patches to be useful: drop them and resync
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(snapshot_frame)
+            if patch_frame is not None:
+                return
+        self.queue.put_nowait(patch_frame)
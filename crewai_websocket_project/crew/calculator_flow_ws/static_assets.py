@@ -0,0 +1,103 @@
+# static_assets.py
+import gzip
+import hashlib
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# The client page URL is not fingerprinted, so browsers keep it briefly and
+# then revalidate with If-None-Match, which costs a header compare and a 304.
+DEFAULT_CACHE_CONTROL = "public, max-age=300, must-revalidate"
+
+# Preferred order when the client accepts several encodings equally.
+ENCODING_PREFERENCE = ("br", "gzip")
+
+
+def _accepted_encodings(header: str) -> dict:
+    """Parse Accept-Encoding into {coding: q}."""
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(header: str, available) -> str:
+    """
+    Best acceptable compressed coding; identity only when none has q>0.
+    Unlisted codings, identity included, take the "*" q value.
+    """
+    accepted = _accepted_encodings(header or "")
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = "identity", 0.0
+    for coding in ENCODING_PREFERENCE:
+        if coding not in available:
+            continue
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    # if identity is refused too ("identity;q=0" or "*;q=0") there is nothing
+    # better to offer, so the uncompressed body is still what gets sent
+    return best
+
+
+class StaticAsset:
+    """
+    An in-memory asset that is compressed once, at construction time.
+    Every encoding gets its own strong ETag (a strong validator must differ
+    per content-coding); a 304 is only sent when If-None-Match names the
+    ETag of the encoding this request would receive.
+    """
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str = DEFAULT_CACHE_CONTROL):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:32]
+
+        self.bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body, quality=11)
+
+        self.etags = {
+            coding: f'"{digest}"' if coding == "identity" else f'"{digest}-{coding}"'
+            for coding in self.bodies
+        }
+
+    @classmethod
+    def from_text(cls, text: str, media_type: str = "text/html; charset=utf-8", **kwargs) -> "StaticAsset":
+        return cls(text.encode("utf-8"), media_type, **kwargs)
+
+    def _not_modified(self, if_none_match: str, coding: str) -> bool:
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return self.etags[coding] in candidates
+
+    def response(self, request: Request) -> Response:
+        coding = choose_encoding(request.headers.get("accept-encoding", ""), self.bodies)
+        headers = {
+            "ETag": self.etags[coding],
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if self._not_modified(request.headers.get("if-none-match", ""), coding):
+            return Response(status_code=304, headers=headers)
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return Response(self.bodies[coding], media_type=self.media_type, headers=headers)
@@ -2,9 +2,15 @@ import random
 from crewai.flow.flow import Flow, listen, router, start
 from pydantic import BaseModel
 import os
+import sys
+from pathlib import Path
 
 os.environ['CREWAI_DISABLE_TELEMETRY'] = 'true'
 
+# reuse the server's plot cache: the plot is only re-rendered when the flow graph changes
+sys.path.insert(0, str(Path(__file__).resolve().parent / "calculator_flow_ws"))
+from plot_cache import plot_once
+
 class ExampleState(BaseModel):
     success_flag: bool = False
 
@@ -33,5 +39,5 @@ class RouterFlow(Flow[ExampleState]):
 
 
 flow = RouterFlow()
-flow.plot("my_flow_plot")
+plot_once(flow, "my_flow_plot")
 flow.kickoff()
\ No newline at end of file